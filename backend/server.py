@@ -1,41 +1,101 @@
 import os
-import uuid
-import base64
+import hashlib
+import secrets
+import queue
 import asyncio
-from typing import List, Optional
-from datetime import datetime, timezone
-from fastapi import FastAPI, HTTPException
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import orjson
+import pybase64
+from bson import Binary
+from typing import Optional
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="Nano Banana Image Generator", version="1.0.0")
+# Logging: records are queued on the event loop thread and written by a listener thread
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(log_queue, logging.StreamHandler())
+logger = logging.getLogger("server")
+logger.setLevel(logging.INFO)
+logger.addHandler(QueueHandler(log_queue))
+logger.propagate = False
 
-# CORS configuration
+app = FastAPI(
+    title="Nano Banana Image Generator",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
+
+# CORS configuration: a comma-separated CORS_ORIGINS list, "*" by default.
+# The wildcard is served without credentials so the middleware can send a
+# static Allow-Origin header instead of echoing each request's Origin.
+CORS_ORIGINS = frozenset(
+    origin.strip() for origin in os.environ.get('CORS_ORIGINS', '*').split(',') if origin.strip()
+)
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=CORS_ORIGINS,
+    allow_credentials="*" not in CORS_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 # MongoDB setup
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = AsyncIOMotorClient(MONGO_URL)
+client = AsyncIOMotorClient(
+    MONGO_URL,
+    compressors="zstd,zlib",
+    zlibCompressionLevel=-1,
+    maxPoolSize=200,
+    minPoolSize=10,
+    maxIdleTimeMS=30000,
+)
 db = client.image_generator
 
+# LLM setup
+EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY')
+IMAGE_MODEL = ("gemini", "gemini-2.5-flash-image-preview")
+IMAGE_SYSTEM_MESSAGE = "You are an expert image generator that creates high-quality images based on text prompts."
+
+# Identical prompts within this window reuse the stored image
+PROMPT_CACHE_TTL_SECONDS = 600
+
+# Maximum number of background prompt cache writes allowed in flight
+PENDING_CACHE_WRITE_LIMIT = 64
+
+# Raw image responses are immutable for a given id
+RAW_IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Data URL prefix for PNG payloads, built once at import
+_PNG_PREFIX = b"data:image/png;base64,"
+
+# Health check body, re-serialized about once a second by a background task
+HEALTH_REFRESH_SECONDS = 1
+
+def render_health():
+    return orjson.dumps({"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()})
+
+_HEALTH_CACHE = render_health()
+
 # Models
 class ImageGenerationRequest(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='ignore')
+
     prompt: str = Field(..., description="The text prompt for image generation")
 
 class ImageGenerationResponse(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='ignore')
+
     id: str
     prompt: str
     image_url: str
@@ -45,24 +105,115 @@ class ImageGenerationResponse(BaseModel):
 class GeneratedImage(BaseModel):
     id: str
     prompt: str
-    image_data: str  # base64 encoded
+    image_data: bytes  # raw image bytes (BSON Binary)
     created_at: str
 
 # Helper functions
-def prepare_for_mongo(data):
-    """Convert datetime objects to ISO strings for MongoDB storage"""
-    if isinstance(data.get('created_at'), datetime):
-        data['created_at'] = data['created_at'].isoformat()
-    return data
-
-def parse_from_mongo(item):
-    """Parse datetime strings back from MongoDB"""
-    if isinstance(item.get('created_at'), str):
-        try:
-            item['created_at'] = datetime.fromisoformat(item['created_at'])
-        except ValueError:
-            pass
-    return item
+def image_bytes_from_mongo(item):
+    """Return raw image bytes, decoding legacy base64 string rows"""
+    image_data = item['image_data']
+    if isinstance(image_data, str):
+        return pybase64.b64decode(image_data)
+    return image_data
+
+def image_data_url(item):
+    """Build a base64 PNG data URL from a stored image document"""
+    encoded = pybase64.b64encode(image_bytes_from_mongo(item))
+    return b"".join((_PNG_PREFIX, encoded)).decode('ascii')
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header, which may list several and weak tags"""
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == etag:
+            return True
+    return False
+
+def prompt_cache_key(prompt):
+    """Cache key for a generation prompt"""
+    return hashlib.sha256(prompt.encode()).digest()
+
+def new_image_chat(session_id):
+    """Build an image-generation chat from the shared module-level config.
+
+    LlmChat keeps per-session message history, so one instance cannot be
+    shared across requests without leaking earlier prompts into later ones.
+    """
+    chat = LlmChat(
+        api_key=EMERGENT_LLM_KEY,
+        session_id=session_id,
+        system_message=IMAGE_SYSTEM_MESSAGE,
+    )
+    chat.with_model(*IMAGE_MODEL).with_params(modalities=["image", "text"])
+    return chat
+
+async def persist_prompt_cache(cache_key, image_id, ts):
+    """Point the prompt cache at a stored image.
+
+    Runs as a background task so the response does not wait on Mongo; the
+    caller has already acquired a write slot, which is released here.
+    """
+    try:
+        await db.prompt_cache.replace_one(
+            {"_id": cache_key},
+            {"image_id": image_id, "ts": ts},
+            upsert=True,
+        )
+    except Exception:
+        logger.exception("Error updating prompt cache")
+    finally:
+        app.state.cache_write_slots.release()
+
+async def schedule_prompt_cache_write(cache_key, image_id, ts):
+    """Start persist_prompt_cache in the background, waiting if the backlog is full"""
+    await app.state.cache_write_slots.acquire()
+    task = asyncio.create_task(persist_prompt_cache(cache_key, image_id, ts))
+    app.state.pending_cache_writes.add(task)
+    task.add_done_callback(app.state.pending_cache_writes.discard)
+
+@app.on_event("startup")
+async def start_log_listener():
+    log_listener.start()
+
+@app.on_event("startup")
+async def init_cache_writes():
+    app.state.pending_cache_writes = set()
+    app.state.cache_write_slots = asyncio.BoundedSemaphore(PENDING_CACHE_WRITE_LIMIT)
+
+@app.on_event("shutdown")
+async def drain_cache_writes():
+    """Finish background prompt cache writes before the process exits"""
+    await asyncio.gather(*app.state.pending_cache_writes)
+
+async def refresh_health_cache():
+    global _HEALTH_CACHE
+    while True:
+        _HEALTH_CACHE = render_health()
+        await asyncio.sleep(HEALTH_REFRESH_SECONDS)
+
+@app.on_event("startup")
+async def start_health_refresh():
+    app.state.health_refresh = asyncio.create_task(refresh_health_cache())
+
+@app.on_event("shutdown")
+async def stop_health_refresh():
+    app.state.health_refresh.cancel()
+
+@app.on_event("startup")
+async def create_indexes():
+    """Ensure the indexes used by image lookups and the list query exist"""
+    await db.generated_images.create_index("id", unique=True)
+    await db.generated_images.create_index([("created_at", -1)])
+    # Sparse so rows stored before content hashing don't collide on a missing sha
+    await db.generated_images.create_index("sha", unique=True, sparse=True)
+    await db.prompt_cache.create_index("ts", expireAfterSeconds=PROMPT_CACHE_TTL_SECONDS)
+
+# Registered last so records logged by earlier shutdown handlers still get written
+@app.on_event("shutdown")
+async def stop_log_listener():
+    log_listener.stop()
 
 @app.get("/")
 async def root():
@@ -70,27 +221,35 @@ async def root():
 
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
+    return Response(content=_HEALTH_CACHE, media_type="application/json")
 
 @app.post("/api/generate-image", response_model=ImageGenerationResponse)
 async def generate_image(request: ImageGenerationRequest):
     """Generate an image using Gemini Nano Banana model"""
     try:
-        # Get the API key
-        api_key = os.environ.get('EMERGENT_LLM_KEY')
-        if not api_key:
+        if not EMERGENT_LLM_KEY:
             raise HTTPException(status_code=500, detail="API key not configured")
         
-        # Create a unique session ID for this request
-        session_id = str(uuid.uuid4())
+        # Serve a recent generation of the same prompt without calling the model.
+        # The TTL monitor only sweeps periodically, so the age is checked here too.
+        cache_key = prompt_cache_key(request.prompt)
+        cache_cutoff = datetime.now(timezone.utc) - timedelta(seconds=PROMPT_CACHE_TTL_SECONDS)
+        cached = await db.prompt_cache.find_one({"_id": cache_key, "ts": {"$gt": cache_cutoff}})
+        if cached is not None:
+            img = await db.generated_images.find_one({"id": cached["image_id"]})
+            if img is not None:
+                # The image may be shared with another prompt through content
+                # dedup, so report this prompt and when it was generated
+                return ORJSONResponse({
+                    "id": img["id"],
+                    "prompt": request.prompt,
+                    "image_url": image_data_url(img),
+                    "created_at": cached["ts"].replace(tzinfo=timezone.utc).isoformat(),
+                    "success": True,
+                })
         
-        # Initialize LlmChat with Gemini model
-        chat = LlmChat(
-            api_key=api_key, 
-            session_id=session_id, 
-            system_message="You are an expert image generator that creates high-quality images based on text prompts."
-        )
-        chat.with_model("gemini", "gemini-2.5-flash-image-preview").with_params(modalities=["image", "text"])
+        # Each request gets its own session so chat history is never shared
+        chat = new_image_chat(secrets.token_hex(16))
         
         # Create the enhanced prompt
         enhanced_prompt = f"Create a high-quality, detailed image: {request.prompt}"
@@ -106,67 +265,111 @@ async def generate_image(request: ImageGenerationRequest):
         generated_image = images[0]
         image_data = generated_image['data']  # This is already base64 encoded
         
-        # Create image record
-        image_id = str(uuid.uuid4())
+        image_bytes = pybase64.b64decode(image_data, validate=False)
+        image_sha = hashlib.sha256(image_bytes).digest()
         current_time = datetime.now(timezone.utc)
         
-        image_record = {
-            "id": image_id,
-            "prompt": request.prompt,
-            "image_data": image_data,
-            "created_at": current_time.isoformat(),
-        }
+        # Byte-identical images are stored once; reuse the existing record
+        image_record = await db.generated_images.find_one({"sha": image_sha}, {"image_data": 0})
+        if image_record is None:
+            # Store the decoded bytes as BSON Binary rather than a base64 string
+            image_record = {
+                "id": secrets.token_hex(16),
+                "prompt": request.prompt,
+                "image_data": Binary(image_bytes),
+                "sha": Binary(image_sha),
+                "created_at": current_time.isoformat(),
+            }
+            
+            # Store in MongoDB; created_at is already an ISO string, so the
+            # record is inserted as-is
+            try:
+                await db.generated_images.insert_one(image_record)
+            except DuplicateKeyError:
+                # A concurrent request stored the same bytes first
+                image_record = await db.generated_images.find_one({"sha": image_sha}, {"image_data": 0})
         
-        # Store in MongoDB
-        mongo_record = prepare_for_mongo(image_record.copy())
-        await db.generated_images.insert_one(mongo_record)
+        # Only the prompt cache update happens off the response path
+        image_id = image_record["id"]
+        await schedule_prompt_cache_write(cache_key, image_id, current_time)
         
         # Return response with data URL for display
-        data_url = f"data:image/png;base64,{image_data}"
-        
-        return ImageGenerationResponse(
-            id=image_id,
-            prompt=request.prompt,
-            image_url=data_url,
-            created_at=current_time.isoformat(),
-            success=True
-        )
+        data_url = b"".join((_PNG_PREFIX, image_data.encode('ascii'))).decode('ascii')
+        
+        # A deduplicated blob keeps its stored record; the caller still gets
+        # their own prompt and generation time back
+        return ORJSONResponse({
+            "id": image_id,
+            "prompt": request.prompt,
+            "image_url": data_url,
+            "created_at": current_time.isoformat(),
+            "success": True,
+        })
         
     except Exception as e:
-        print(f"Error generating image: {str(e)}")
+        logger.exception("Error generating image")
         raise HTTPException(status_code=500, detail=f"Failed to generate image: {str(e)}")
 
-@app.get("/api/images", response_model=List[ImageGenerationResponse])
-async def get_generated_images(limit: int = 10):
+@app.get("/api/images")
+async def get_generated_images(limit: int = 10, include_data: bool = False):
     """Get recently generated images"""
     try:
-        # Fetch recent images from MongoDB
-        cursor = db.generated_images.find().sort("created_at", -1).limit(limit)
-        images = await cursor.to_list(length=None)
+        # Fetch recent image metadata; the bytes are served by the raw endpoint
+        # unless the caller asks for inline data URLs
+        projection = None if include_data else {"image_data": 0}
+        cursor = (
+            db.generated_images.find({}, projection, batch_size=max(limit, 0))
+            .sort("created_at", -1)
+            .hint([("created_at", -1)])
+            .limit(limit)
+        )
         
-        # Convert to response format
+        # Convert to response format as documents stream off the cursor
         result = []
-        for img in images:
-            data_url = f"data:image/png;base64,{img['image_data']}"
-            # Ensure created_at is a string
-            created_at_str = img['created_at']
-            if isinstance(created_at_str, datetime):
-                created_at_str = created_at_str.isoformat()
+        async for img in cursor:
+            if include_data:
+                image_url = image_data_url(img)
+            else:
+                image_url = f"/api/images/{img['id']}/raw"
             
-            result.append(ImageGenerationResponse(
-                id=img['id'],
-                prompt=img['prompt'],
-                image_url=data_url,
-                created_at=created_at_str,
-                success=True
-            ))
+            result.append({
+                "id": img['id'],
+                "prompt": img['prompt'],
+                "image_url": image_url,
+                "created_at": img['created_at'],
+                "success": True,
+            })
         
-        return result
+        return ORJSONResponse(result)
         
     except Exception as e:
-        print(f"Error fetching images: {str(e)}")
+        logger.exception("Error fetching images")
         raise HTTPException(status_code=500, detail=f"Failed to fetch images: {str(e)}")
 
+@app.get("/api/images/{image_id}/raw")
+async def get_raw_image(image_id: str, if_none_match: Optional[str] = Header(None)):
+    """Serve the stored bytes of a generated image"""
+    try:
+        # Images never change once stored, so the id doubles as the ETag
+        # and browsers can keep the bytes indefinitely
+        headers = {"ETag": f'"{image_id}"', "Cache-Control": RAW_IMAGE_CACHE_CONTROL}
+        if if_none_match and etag_matches(if_none_match, headers["ETag"]):
+            if await db.generated_images.find_one({"id": image_id}, {"_id": 1}) is None:
+                raise HTTPException(status_code=404, detail="Image not found")
+            return Response(status_code=304, headers=headers)
+        
+        img = await db.generated_images.find_one({"id": image_id}, {"image_data": 1})
+        if img is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        
+        return Response(content=image_bytes_from_mongo(img), media_type="image/png", headers=headers)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error fetching image")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch image: {str(e)}")
+
 @app.delete("/api/images/{image_id}")
 async def delete_image(image_id: str):
     """Delete a generated image"""
@@ -180,9 +383,18 @@ async def delete_image(image_id: str):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error deleting image: {str(e)}")
+        logger.exception("Error deleting image")
         raise HTTPException(status_code=500, detail=f"Failed to delete image: {str(e)}")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=8001,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", "4")),
+        access_log=False,
+        log_level="warning",
+    )
\ No newline at end of file
@@ -116,6 +116,12 @@ def test_get_images():
             data = response.json()
             print(f"Number of images retrieved: {len(data)}")
             
+            # A negative limit must not reach the cursor as a negative batch size
+            negative_response = requests.get(f"{BASE_URL}/images", params={"limit": -1}, timeout=TIMEOUT)
+            if negative_response.status_code != 200:
+                print(f"❌ Get images with limit=-1 failed with status {negative_response.status_code}")
+                return False
+                
             if len(data) > 0:
                 # Check first image structure
                 first_image = data[0]
@@ -126,6 +132,23 @@ def test_get_images():
                     print(f"❌ Missing required fields in image data: {missing_fields}")
                     return False
                     
+                # By default the list links to the raw endpoint instead of embedding bytes
+                expected_url = f"/api/images/{first_image['id']}/raw"
+                if first_image["image_url"] != expected_url:
+                    print(f"❌ Expected image_url {expected_url}, got {first_image['image_url'][:60]}")
+                    return False
+                    
+                # include_data=1 restores inline data URLs
+                inline_response = requests.get(f"{BASE_URL}/images", params={"include_data": 1}, timeout=TIMEOUT)
+                if inline_response.status_code != 200:
+                    print(f"❌ Get images with include_data failed with status {inline_response.status_code}")
+                    return False
+                    
+                inline_images = inline_response.json()
+                if not all(img["image_url"].startswith("data:image/png;base64,") for img in inline_images):
+                    print("❌ include_data=1 did not return data URLs")
+                    return False
+                    
                 print(f"✅ Images retrieved successfully")
                 print(f"Sample image ID: {first_image['id']}")
                 print(f"Sample prompt: {first_image['prompt'][:50]}...")
@@ -146,6 +169,64 @@ def test_get_images():
         print(f"❌ Get images test error: {str(e)}")
         return False
 
+def test_get_raw_image(image_id):
+    """Test fetching the raw bytes of a generated image"""
+    print(f"\n=== Testing Raw Image Endpoint ===")
+    if not image_id:
+        print("⚠️ No image ID provided, skipping raw image test")
+        return True
+        
+    try:
+        response = requests.get(f"{BASE_URL}/images/{image_id}/raw", timeout=TIMEOUT)
+        print(f"Status Code: {response.status_code}")
+        
+        if response.status_code == 200:
+            content_type = response.headers.get("content-type", "")
+            if not content_type.startswith("image/"):
+                print(f"❌ Unexpected content type: {content_type}")
+                return False
+                
+            if len(response.content) == 0:
+                print("❌ Raw image response is empty")
+                return False
+                
+            print(f"✅ Raw image retrieved successfully! Size: {len(response.content)} bytes")
+            
+            # The image id doubles as the ETag for conditional requests
+            etag = f'"{image_id}"'
+            if response.headers.get("etag") != etag:
+                print(f"❌ Expected ETag {etag}, got {response.headers.get('etag')}")
+                return False
+                
+            conditional_cases = [
+                (image_id, f'W/{etag}', 304),
+                (image_id, f'"x", {etag}', 304),
+                ("non-existent-image-id-12345", "*", 404),
+            ]
+            for case_id, if_none_match, expected_status in conditional_cases:
+                conditional = requests.get(
+                    f"{BASE_URL}/images/{case_id}/raw",
+                    headers={"If-None-Match": if_none_match},
+                    timeout=TIMEOUT
+                )
+                if conditional.status_code != expected_status:
+                    print(f"❌ If-None-Match {if_none_match} on {case_id}: expected {expected_status}, got {conditional.status_code}")
+                    return False
+                    
+            print("✅ Conditional requests handled correctly")
+            return True
+        else:
+            print(f"Response: {response.text}")
+            print(f"❌ Get raw image failed with status {response.status_code}")
+            return False
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Get raw image request failed: {str(e)}")
+        return False
+    except Exception as e:
+        print(f"❌ Get raw image test error: {str(e)}")
+        return False
+
 def test_delete_image(image_id):
     """Test deleting a generated image"""
     print(f"\n=== Testing Delete Image Endpoint ===")
@@ -224,10 +305,13 @@ def main():
     # Test 3: Get Images
     results["get_images"] = test_get_images()
     
-    # Test 4: Delete Image (using generated image if available)
+    # Test 4: Raw Image Bytes
+    results["get_raw_image"] = test_get_raw_image(generated_image_id)
+    
+    # Test 5: Delete Image (using generated image if available)
     results["delete_image"] = test_delete_image(generated_image_id)
     
-    # Test 5: Delete Non-existent Image
+    # Test 6: Delete Non-existent Image
     results["delete_nonexistent"] = test_delete_nonexistent_image()
     
     # Summary
@@ -20,7 +20,11 @@ function App() {
       const response = await fetch(`${backendUrl}/api/images?limit=6`);
       if (response.ok) {
         const images = await response.json();
-        setImageHistory(images);
+        // History entries point at the raw image endpoint relative to the API
+        setImageHistory(images.map(image => ({
+          ...image,
+          image_url: image.image_url.startsWith('/') ? `${backendUrl}${image.image_url}` : image.image_url,
+        })));
       }
     } catch (err) {
       console.error('Error fetching image history:', err);